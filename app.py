@@ -32,14 +32,20 @@ Digital Signage Application - Versión Modularizada
 Flask Backend con templates separados
 """
 
-from flask import Flask, render_template, request, jsonify, url_for, session, redirect
-from functools import wraps
+from flask import Flask, render_template, request, url_for, session, redirect, send_from_directory, Response
+from concurrent.futures import ThreadPoolExecutor
+from functools import cache
+from werkzeug.exceptions import NotFound
+import copy
 import os
-import json
 import hashlib
-from datetime import datetime
+import orjson
+import secrets
 from dotenv import load_dotenv
+from jinja2 import FileSystemBytecodeCache
 from werkzeug.utils import secure_filename
+from streaming_form_data import StreamingFormDataParser, ParseFailedException
+from streaming_form_data.targets import FileTarget
 
 # Cargar variables de entorno
 load_dotenv(verbose=True)
@@ -50,49 +56,196 @@ ADMIN_PASSWORD = os.getenv('ADMIN_PASSWD')
 
 app.config['UPLOAD_FOLDER'] = os.getenv('UP_FOLDER')
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_CONTENT_LENG'))
-app.config['ALLOWED_EXTENSIONS'] = set(os.getenv('ALLOWED_EXT').split(','))
-app.config['ALLOWED_VIDEO_EXTENSIONS'] = set(os.getenv('ALLOWED_VIDEO_EXT').split(','))
+# Extensiones permitidas, normalizadas una sola vez al arrancar
+# (strip + lower evita misses silenciosos por espacios en la variable de entorno)
+ALLOWED_IMAGE_EXTENSIONS = frozenset(e.strip().lower() for e in os.getenv('ALLOWED_EXT').split(','))
+ALLOWED_VIDEO_EXTENSIONS = frozenset(e.strip().lower() for e in os.getenv('ALLOWED_VIDEO_EXT').split(','))
+app.config['ALLOWED_EXTENSIONS'] = ALLOWED_IMAGE_EXTENSIONS
+app.config['ALLOWED_VIDEO_EXTENSIONS'] = ALLOWED_VIDEO_EXTENSIONS
 
-# Crear estructura de carpetas
+# Mapa extensión -> tipo, para clasificar un upload con un solo lookup
+EXTENSION_TYPES = {ext: 'image' for ext in ALLOWED_IMAGE_EXTENSIONS}
+EXTENSION_TYPES.update({ext: 'video' for ext in ALLOWED_VIDEO_EXTENSIONS})
+
+# Los templates no cambian en producción: sin stat de mtime por render
+app.config['TEMPLATES_AUTO_RELOAD'] = False
+app.jinja_env.auto_reload = False
+
+# Reutilizar el bytecode compilado de los templates entre reinicios
+JINJA_CACHE_DIR = 'data/.jinja_cache'
+
+class _OptionalBytecodeCache(FileSystemBytecodeCache):
+    """Caché de bytecode que tolera que el directorio aún no exista
+
+    Importar el módulo no debe crear carpetas (ver _ensure_folders); hasta
+    que `flask init-dirs` corra, los volcados simplemente se omiten.
+    """
+    def dump_bytecode(self, bucket):
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+app.jinja_env.bytecode_cache = _OptionalBytecodeCache(directory=JINJA_CACHE_DIR)
+
+@cache
+def _get_template(name):
+    """Obtener un template compilado, cacheado por nombre de archivo
+
+    La caché es ilimitada pero el espacio de claves son los nombres de
+    template de la aplicación, así que la memoria queda acotada.
+    """
+    return app.jinja_env.get_template(name)
+
+# Precompilar el template de pantalla al arrancar
+_get_template('screen_base.html')
+
+@cache
+def _get_screen_template(screen_id):
+    """Template de screen_base.html especializado para una pantalla
+
+    screen_id queda fijado en los globals del template compilado, así cada
+    generación solo pasa los campos realmente dinámicos (slides y marquesina).
+    """
+    source = app.jinja_env.loader.get_source(app.jinja_env, 'screen_base.html')[0]
+    return app.jinja_env.from_string(source, globals={'screen_id': screen_id})
+
+# Especializar las cinco pantallas al arrancar
+for _screen_id in range(1, 6):
+    _get_screen_template(_screen_id)
+
+# Estructura de carpetas (se crea con `flask init-dirs` o al arrancar con python app.py)
 RAW_FOLDER = os.getenv('FOLDERS_ESTRUC')
 FOLDERS = [folder.strip() for folder in RAW_FOLDER.split(',')]
 
-for folder in FOLDERS:
-    os.makedirs(folder, exist_ok=True)
+def _ensure_folders():
+    """Crear la estructura de carpetas de datos, uploads y caché"""
+    for folder in FOLDERS + [JINJA_CACHE_DIR]:
+        os.makedirs(folder, exist_ok=True)
+
+@app.cli.command('init-dirs')
+def init_dirs():
+    """Crear la estructura de carpetas de la aplicación"""
+    _ensure_folders()
 
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if not session.get('logged_in'):
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
-    return decorated_function
+@app.cli.command('format-configs')
+def format_configs():
+    """Reescribir las configuraciones guardadas con indentación legible"""
+    for screen_id in range(1, 6):
+        config_path = f'data/config/pantalla{screen_id}.json'
+        try:
+            with open(config_path, 'rb') as f:
+                config = orjson.loads(f.read())
+        except FileNotFoundError:
+            continue
+        with open(config_path, 'wb') as f:
+            f.write(orjson.dumps(config, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+
+# Endpoints accesibles sin login (las pantallas son públicas por diseño)
+PUBLIC_ENDPOINTS = frozenset({'login', 'logout', 'show_screen', 'static'})
+
+@app.before_request
+def require_login():
+    """Exigir sesión iniciada en todo endpoint que no sea público"""
+    if request.endpoint not in PUBLIC_ENDPOINTS and not session.get('logged_in'):
+        return redirect(url_for('login'))
+
+@app.after_request
+def cache_uploads_forever(response):
+    """Los uploads llevan nombre por hash de contenido: cacheables para siempre"""
+    if request.path.startswith('/static/uploads/'):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+class HashingFileTarget(FileTarget):
+    """FileTarget que calcula el blake2b del contenido mientras lo escribe"""
+    def __init__(self, filename, **kwargs):
+        super().__init__(filename, **kwargs)
+        self.hasher = hashlib.blake2b(digest_size=12)
+
+    def on_data_received(self, chunk):
+        self.hasher.update(chunk)
+        super().on_data_received(chunk)
+
+def file_type_for(filename):
+    """Clasificar un archivo por su extensión: 'image', 'video' o None"""
+    i = filename.rfind('.')
+    if i == -1:
+        return None
+    return EXTENSION_TYPES.get(filename[i + 1:].lower())
 
 def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+    return file_type_for(filename) == 'image'
 
 def allowed_video(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_VIDEO_EXTENSIONS']
+    return file_type_for(filename) == 'video'
 
 def generate_hash_id():
-    """Generar ID único usando hash"""
-    timestamp = datetime.now().isoformat()
-    random_str = os.urandom(16).hex()
-    return hashlib.md5(f"{timestamp}{random_str}".encode()).hexdigest()[:12]
+    """Generar ID único aleatorio de 12 caracteres hex"""
+    return secrets.token_hex(6)
+
+def ojson(payload, status=200):
+    """Respuesta JSON serializada con orjson, sin el overhead de jsonify"""
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+# Caché en memoria del HTML generado: screen_id -> (hash de config, html)
+_html_cache = {}
+
+def _config_hash(config):
+    """Hash estable de la configuración, para detectar cambios"""
+    return hashlib.md5(orjson.dumps(config, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+# Caché de configuraciones parseadas: screen_id -> (st_mtime_ns, config)
+_cfg_cache = {}
 
 def load_screen_config(screen_id):
-    """Cargar configuración de una pantalla"""
+    """Cargar configuración de una pantalla (cacheada por mtime del archivo)"""
     config_path = f'data/config/pantalla{screen_id}.json'
-    if os.path.exists(config_path):
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {'screen_id': screen_id, 'slides': []}
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except FileNotFoundError:
+        return {'screen_id': screen_id, 'slides': []}
+    cached = _cfg_cache.get(screen_id)
+    if cached is not None and cached[0] == mtime:
+        return copy.deepcopy(cached[1])
+    with open(config_path, 'rb') as f:
+        config = orjson.loads(f.read())
+    _cfg_cache[screen_id] = (mtime, config)
+    return copy.deepcopy(config)
 
 def save_screen_config(screen_id, config):
     """Guardar configuración de una pantalla"""
     config_path = f'data/config/pantalla{screen_id}.json'
-    with open(config_path, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=2, ensure_ascii=False)
+    # Forma compacta: estos archivos los lee la máquina; `flask format-configs`
+    # los reindenta si alguien necesita inspeccionarlos
+    with open(config_path, 'wb') as f:
+        f.write(orjson.dumps(config, option=orjson.OPT_NON_STR_KEYS))
+    # Refrescar la caché de configuración para que la próxima lectura sea un hit
+    _cfg_cache[screen_id] = (os.stat(config_path).st_mtime_ns, copy.deepcopy(config))
+    # Sidecar con solo el conteo de slides: /api/screens lo lee sin tener
+    # que parsear la configuración completa
+    with open(f'data/config/pantalla{screen_id}.meta.json', 'wb') as f:
+        f.write(orjson.dumps({'slides_count': len(config.get('slides', []))}))
+    # La configuración cambió: el HTML cacheado ya no es válido
+    _html_cache.pop(screen_id, None)
+
+# Pool pequeño para solapar las lecturas independientes de /api/screens
+_POOL = ThreadPoolExecutor(max_workers=5)
+
+def _screen_summary(screen_id):
+    """Resumen de una pantalla para la lista de /api/screens"""
+    try:
+        with open(f'data/config/pantalla{screen_id}.meta.json', 'rb') as f:
+            slides_count = orjson.loads(f.read())['slides_count']
+    except FileNotFoundError:
+        # Configuraciones guardadas antes de que existiera el sidecar
+        slides_count = len(load_screen_config(screen_id).get('slides', []))
+    return {
+        'id': screen_id,
+        'name': f'Pantalla {screen_id}',
+        'slides_count': slides_count,
+        'has_content': slides_count > 0
+    }
 
 def generate_screen_html(screen_id):
     """
@@ -100,26 +253,44 @@ def generate_screen_html(screen_id):
     MODULARIZADO: Usa Jinja2 templates en lugar de strings concatenados
     """
     config = load_screen_config(screen_id)
+    output_path = f'data/screens/pantalla{screen_id}/index.html'
+
+    # Si la configuración no cambió desde la última generación, no hay nada que hacer
+    config_hash = _config_hash(config)
+    cached = _html_cache.get(screen_id)
+    if cached is not None and cached[0] == config_hash:
+        return output_path
+
     slides = config.get('slides', [])
-    
+
     # Extraer datos de la marquesina
     marquee_enabled = config.get('marquee_enabled', False)
     marquee_text = config.get('marquee_text', "")
-    
-    # Renderizar el template usando Jinja2
-    html_content = render_template(
-        'screen_base.html',
-        screen_id=screen_id,
-        slides_json=json.dumps(slides, ensure_ascii=False),
+
+    # Renderizar con el template precompilado y especializado para esta pantalla
+    html_content = _get_screen_template(screen_id).render(
+        slides_json=orjson.dumps(slides).decode('utf-8'),
         marquee_enabled=marquee_enabled,
         marquee_text=marquee_text
     )
-    
-    # Guardar el HTML generado
-    output_path = f'data/screens/pantalla{screen_id}/index.html'
-    with open(output_path, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    
+
+    # Evitar reescribir el archivo si el contenido no cambió
+    # (el hash del último HTML escrito se persiste junto al index.html)
+    new_hash = hashlib.md5(html_content.encode('utf-8')).hexdigest()
+    hash_path = output_path + '.hash'
+    old_hash = None
+    if os.path.exists(hash_path):
+        with open(hash_path, 'r', encoding='utf-8') as f:
+            old_hash = f.read().strip()
+
+    if new_hash != old_hash or not os.path.exists(output_path):
+        # Guardar el HTML generado y su hash
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(html_content)
+        with open(hash_path, 'w', encoding='utf-8') as f:
+            f.write(new_hash)
+
+    _html_cache[screen_id] = (config_hash, html_content)
     return output_path
 
 # ===== RUTAS DE AUTENTICACIÓN =====
@@ -148,74 +319,91 @@ def logout():
 # ===== RUTAS PRINCIPALES =====
 
 @app.route('/')
-@login_required
 def index():
     """Página principal de administración"""
     return render_template('index.html')
 
 @app.route('/api/screens')
-@login_required
 def get_screens():
     """Obtener lista de pantallas configuradas"""
-    screens = []
-    for i in range(1, 6):
-        config = load_screen_config(i)
-        screens.append({
-            'id': i,
-            'name': f'Pantalla {i}',
-            'slides_count': len(config.get('slides', [])),
-            'has_content': len(config.get('slides', [])) > 0
-        })
-    return jsonify(screens)
+    # Las cinco lecturas son independientes: solaparlas en el pool oculta
+    # la latencia de disco cuando la caché está fría
+    screens = list(_POOL.map(_screen_summary, range(1, 6)))
+    return ojson(screens)
 
 @app.route('/api/screen/<int:screen_id>')
-@login_required
 def get_screen(screen_id):
     """Obtener configuración de una pantalla"""
     if screen_id < 1 or screen_id > 5:
-        return jsonify({'error': 'ID de pantalla inválido'}), 400
+        return ojson({'error': 'ID de pantalla inválido'}, 400)
     
     config = load_screen_config(screen_id)
-    return jsonify(config)
+    return ojson(config)
 
 @app.route('/api/screen/<int:screen_id>', methods=['POST'])
-@login_required
 def save_screen(screen_id):
     """Guardar configuración de una pantalla"""
     if screen_id < 1 or screen_id > 5:
-        return jsonify({'error': 'ID de pantalla inválido'}), 400
+        return ojson({'error': 'ID de pantalla inválido'}, 400)
     
     data = request.json
+    if not isinstance(data, dict):
+        return ojson({'error': 'La configuración debe ser un objeto JSON'}, 400)
     save_screen_config(screen_id, data)
-    return jsonify({'success': True, 'message': 'Configuración guardada'})
+
+    # Regenerar el HTML en el momento del guardado para que la pantalla
+    # nunca sirva contenido desactualizado ni un 404 por falta de generación
+    try:
+        generate_screen_html(screen_id)
+    except Exception as e:
+        return ojson({'error': str(e)}, 500)
+
+    return ojson({'success': True, 'message': 'Configuración guardada'})
 
 @app.route('/api/upload', methods=['POST'])
-@login_required
 def upload_file():
-    """Subir imagen o video"""
-    if 'file' not in request.files:
-        return jsonify({'error': 'No se envió ningún archivo'}), 400
-    
-    file = request.files['file']
-    if file.filename == '':
-        return jsonify({'error': 'Nombre de archivo vacío'}), 400
-    
-    file_type = None
-    if file and allowed_file(file.filename):
-        file_type = 'image'
-    elif file and allowed_video(file.filename):
-        file_type = 'video'
-    else:
-        return jsonify({'error': 'Tipo de archivo no permitido'}), 400
-    
-    filename = secure_filename(file.filename)
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    filename = f"{timestamp}_{filename}"
+    """Subir imagen o video en streaming, sin pasar por el form parser de Werkzeug"""
+    # Los chunks se escriben directamente a un archivo temporal en la carpeta
+    # de destino; el nombre real solo se conoce al parsear la cabecera del part
+    tmp_path = os.path.join(app.config['UPLOAD_FOLDER'], f'.upload_{os.urandom(8).hex()}.part')
+    target = HashingFileTarget(tmp_path)
+    try:
+        parser = StreamingFormDataParser(headers=request.headers)
+        parser.register('file', target)
+
+        chunk = request.stream.read(65536)
+        while chunk:
+            parser.data_received(chunk)
+            chunk = request.stream.read(65536)
+    except ParseFailedException:
+        # Content-Type que no es multipart/form-data, sin boundary, etc.
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return ojson({'error': 'Petición multipart inválida'}, 400)
+
+    original_filename = target.multipart_filename
+    if not original_filename:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return ojson({'error': 'No se envió ningún archivo'}, 400)
+
+    file_type = file_type_for(original_filename)
+    if file_type is None:
+        os.remove(tmp_path)
+        return ojson({'error': 'Tipo de archivo no permitido'}, 400)
+
+    # Nombre por hash de contenido: el mismo archivo resubido (logo, promo)
+    # reutiliza el existente y la URL resultante es inmutable
+    ext = os.path.splitext(secure_filename(original_filename))[1].lower()
+    filename = f"{target.hasher.hexdigest()}{ext}"
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(filepath)
-    
+    if os.path.exists(filepath):
+        os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, filepath)
+
     url = url_for('static', filename=f'uploads/{filename}')
-    return jsonify({
+    return ojson({
         'success': True,
         'url': url,
         'filename': filename,
@@ -223,22 +411,21 @@ def upload_file():
     })
 
 @app.route('/api/generate/<int:screen_id>', methods=['POST'])
-@login_required
 def generate_screen(screen_id):
     """Generar HTML de presentación"""
     if screen_id < 1 or screen_id > 5:
-        return jsonify({'error': 'ID de pantalla inválido'}), 400
+        return ojson({'error': 'ID de pantalla inválido'}, 400)
     
     try:
         output_path = generate_screen_html(screen_id)
-        return jsonify({
+        return ojson({
             'success': True,
             'message': f'Presentación generada exitosamente',
             'url': f'/pantalla{screen_id}',
             'path': output_path
         })
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return ojson({'error': str(e)}, 500)
 
 @app.route('/pantalla<int:screen_id>')
 def show_screen(screen_id):
@@ -246,14 +433,20 @@ def show_screen(screen_id):
     if screen_id < 1 or screen_id > 5:
         return "Pantalla no encontrada", 404
     
-    html_path = f'data/screens/pantalla{screen_id}/index.html'
-    if not os.path.exists(html_path):
+    try:
+        # send_from_directory deja que Werkzeug use wsgi.file_wrapper/sendfile
+        # y responda 304 a los GET condicionales de las TVs; max_age permite a
+        # los navegadores de las TVs reutilizar la copia local entre polls.
+        # abspath ancla la ruta al cwd, igual que el resto de rutas de datos
+        # (un path relativo aquí se resolvería contra app.root_path)
+        return send_from_directory(os.path.abspath(f'data/screens/pantalla{screen_id}'), 'index.html',
+                                   max_age=60, conditional=True, etag=True)
+    except NotFound:
         return f"La pantalla {screen_id} aún no ha sido generada. Por favor, genera la presentación primero.", 404
-    
-    with open(html_path, 'r', encoding='utf-8') as f:
-        return f.read()
 
 if __name__ == '__main__':
+    _ensure_folders()
+
     print("=" * 60)
     print("🖥️  DIGITAL SIGNAGE APPLICATION - MODULAR")
     print("=" * 60)
@@ -264,4 +457,6 @@ if __name__ == '__main__':
     print("=" * 60)
     print("\n✅ Servidor iniciado. Presiona CTRL+C para detener.\n")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Debug solo si se pide explícitamente; en producción servir con
+    # gunicorn/uwsgi (ej: gunicorn -w 4 -b 0.0.0.0:5000 app:app)
+    app.run(debug=os.getenv('FLASK_DEBUG') == '1', host='0.0.0.0', port=5000)
\ No newline at end of file